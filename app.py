@@ -1,126 +1,191 @@
-"""
-app.py
-
-Flask web application that exposes:
-
-- "/"          : Simple UI (HTML) for chatting with the assistant.
-- "/api/chat"  : POST endpoint for architecture generation.
-
-Flow:
-1. User enters requirements in the browser.
-2. Frontend sends the text to /api/chat.
-3. Backend:
-   - Builds a full requirements text (initial + refinements).
-   - Calls the LLM (architecture_agent.call_llm_for_architecture).
-   - That function now uses LangGraph + MemorySaver to REFINE
-     the previous architecture plan for the same conversation_id.
-   - Builds a diagram with Graphviz (diagram_generator.generate_graphviz_diagram).
-   - Returns summary, components, connections, SVG URL, and DOT source.
-4. Frontend displays the answer and the diagram, and shows DOT code.
-"""
-
-from flask import Flask, jsonify, render_template, request
-
-from architecture_agent import call_llm_for_architecture
-from diagram_generator import generate_graphviz_diagram
-
-app = Flask(__name__)
-
-
-@app.route("/")
-def index():
-    """
-    Render the main UI.
-    """
-    return render_template("index.html")
-
-
-@app.route("/api/chat", methods=["POST"])
-def api_chat():
-    """
-    Accepts JSON:
-    {
-        "message": "latest user message",
-        "history": ["previous prompt 1", "previous prompt 2", ...],  # optional
-        "conversation_id": "stable id for this conversation (optional)"
-    }
-
-    Backend will:
-    - Combine history + latest message into one 'full requirements' text.
-    - Call call_llm_for_architecture(full_requirements_text, thread_id=conversation_id),
-      which now REFINES the previous architecture (if any) for this conversation.
-    """
-    data = request.get_json(force=True)
-
-    # Latest user message
-    user_message = (data.get("message") or "").strip()
-
-    # History from client (list of previous prompts)
-    history = data.get("history", [])
-    if not isinstance(history, list):
-        history = []
-
-    # Conversation identifier for LangGraph thread_id
-    conversation_id = data.get("conversation_id")
-    if not conversation_id:
-        # Fallback: per-client IP if no explicit ID was sent
-        conversation_id = request.remote_addr or "default"
-
-    if not user_message and not history:
-        return jsonify({"error": "Message is required."}), 400
-
-    # Build full requirements text.
-    # This keeps your original refinement semantics:
-    # - First prompt is treated as base.
-    # - Later prompts are prefixed with "Refinement request:".
-    parts = []
-    for idx, msg in enumerate(history):
-        msg = (msg or "").strip()
-        if not msg:
-            continue
-        if idx == 0:
-            # First prompt as-is
-            parts.append(msg)
-        else:
-            # Subsequent prompts marked as refinement
-            parts.append(f"Refinement request: {msg}")
-
-    if user_message:
-        # Current message as latest refinement (or first if none before)
-        if not parts:
-            parts.append(user_message)
-        else:
-            parts.append(f"Refinement request: {user_message}")
-
-    full_requirements_text = "\n\n".join(parts).strip()
-
-    try:
-        # Now truly stateful: the LangGraph workflow will use the stored
-        # arch_history for this conversation_id to refine the previous plan.
-        arch_plan = call_llm_for_architecture(
-            full_requirements_text,
-            thread_id=conversation_id,
-        )
-    except RuntimeError as ex:
-        # This will catch our "Connection error: unable to reach Azure OpenAI..."
-        # from architecture_agent
-        return jsonify({"error": str(ex)}), 502  # 502 Bad Gateway (upstream service error)
-
-    image_url, dot_source = generate_graphviz_diagram(arch_plan)
-
-    response_payload = {
-        "summary": arch_plan.get("summary", ""),
-        "pattern_id": arch_plan.get("pattern_id", ""),
-        "components": arch_plan.get("components", []),
-        "connections": arch_plan.get("connections", []),
-        "image_url": image_url,
-        "dot": dot_source,
-    }
-
-    return jsonify(response_payload)
-
-
-if __name__ == "__main__":
-    # Run development server
-    # Access it in your browser at: http://127.0.0.1:5000
-    app.run(debug=True)
+"""
+app.py
+
+Flask web application that exposes:
+
+- "/"          : Simple UI (HTML) for chatting with the assistant.
+- "/api/chat"  : POST endpoint for architecture generation.
+
+Flow:
+1. User enters requirements in the browser.
+2. Frontend sends the text to /api/chat.
+3. Backend:
+   - Marks the message as a first prompt or a refinement, based on
+     whether server-side state already exists for the conversation.
+   - Calls the LLM (architecture_agent.call_llm_for_architecture).
+   - That function now uses LangGraph + MemorySaver to REFINE
+     the previous architecture plan for the same conversation_id.
+   - Builds a diagram with Graphviz (diagram_generator.generate_graphviz_diagram).
+   - Returns summary, components, connections, SVG URL, and DOT source.
+4. Frontend displays the answer and the diagram, and shows DOT code.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import orjson
+from flask import Flask, jsonify, render_template, request
+from flask.json.provider import DefaultJSONProvider
+
+import architecture_agent
+import diagram_generator
+from architecture_agent import call_llm_for_architecture, has_conversation_state
+from diagram_generator import generate_graphviz_diagram
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson (C extension).
+
+    The arch_plan payload (summary HTML + components + connections +
+    DOT source) is serialized on every /api/chat response; orjson dumps
+    to bytes in C and skips ensure_ascii, which is noticeably faster
+    than stdlib json on large dot_source strings.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Idempotency guard: hash of the last raw message per conversation and
+# the payload it produced. A re-sent identical message (double-click,
+# network retry) gets the previous response back without another
+# LLM + Graphviz cycle. Bounded LRU so fallback per-IP conversation ids
+# can't accumulate full response payloads forever.
+_LAST_RESPONSES_MAX_ENTRIES = 1024
+# conversation_id -> (message_hash, response_payload)
+_last_responses = OrderedDict()
+_last_responses_lock = threading.Lock()
+
+# Warm lazy initialization at import (tiktoken tables, the persistent
+# dot process) so the ~200-500ms cold-start cost lands on worker spawn,
+# not on the first user request. Flask 2.3 removed before_first_request;
+# import time runs once per worker, which is the behavior we want.
+for _warm in (architecture_agent.warm_up, diagram_generator.warm_up):
+    try:
+        _warm()
+    except Exception as _ex:
+        app.logger.warning("Startup warmup failed: %s", _ex)
+
+
+@app.route("/")
+def index():
+    """
+    Render the main UI.
+    """
+    return render_template("index.html")
+
+
+@app.route("/api/chat", methods=["POST"])
+def api_chat():
+    """
+    Accepts JSON:
+    {
+        "message": "latest user message",
+        "conversation_id": "stable id for this conversation (optional)"
+    }
+
+    The client sends ONLY the latest message. The server already holds
+    this conversation's state (previous plan) in the LangGraph
+    checkpointer, so resending the full history every turn was O(N)
+    network payload for nothing — and a changing prompt prefix defeats
+    server-side caching. The backend marks follow-up messages as
+    refinements by checking whether checkpointed state exists.
+    """
+    # Parse the body with orjson directly; skips Werkzeug's slower
+    # get_json machinery (mimetype checks + stdlib json).
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return jsonify({"error": "Invalid JSON body."}), 400
+
+    # Latest user message
+    user_message = (data.get("message") or "").strip()
+
+    # Conversation identifier for LangGraph thread_id
+    conversation_id = data.get("conversation_id")
+    if not conversation_id:
+        # Fallback: per-client IP if no explicit ID was sent
+        conversation_id = request.remote_addr or "default"
+
+    if not user_message:
+        return jsonify({"error": "Message is required."}), 400
+
+    # Identical resend of the last message for this conversation?
+    # Serve the recorded response instead of re-running the pipeline.
+    # Hash the RAW message, before any refinement prefix: by the time a
+    # retry of the first message arrives the conversation already has
+    # state, so a hash of the prefixed text would never match it.
+    text_hash = hashlib.sha256(user_message.encode()).hexdigest()
+    with _last_responses_lock:
+        last = _last_responses.get(conversation_id)
+        if last is not None:
+            _last_responses.move_to_end(conversation_id)
+    if last is not None and last[0] == text_hash:
+        return jsonify(last[1])
+
+    # Keep the original refinement semantics without the client resending
+    # history: the first prompt goes through as-is, later prompts are
+    # marked as refinements. Whether this is a follow-up turn comes from
+    # the server-side checkpointer, not the payload.
+    is_follow_up = has_conversation_state(conversation_id)
+    if is_follow_up:
+        full_requirements_text = f"Refinement request: {user_message}"
+    else:
+        full_requirements_text = user_message
+
+    try:
+        # Now truly stateful: the LangGraph workflow will use the stored
+        # arch_history for this conversation_id to refine the previous plan.
+        # The LLM round-trip blocks for seconds but is pure I/O, so
+        # concurrency comes from threaded workers (the dev server is
+        # threaded; use gunicorn --threads in production) rather than an
+        # async view — Flask runs those through AsyncToSync, which pins
+        # the worker thread anyway.
+        arch_plan = call_llm_for_architecture(
+            full_requirements_text,
+            conversation_id,
+        )
+    except RuntimeError as ex:
+        # This will catch our "Connection error: unable to reach Azure OpenAI..."
+        # from architecture_agent
+        return jsonify({"error": str(ex)}), 502  # 502 Bad Gateway (upstream service error)
+
+    image_url, dot_source = generate_graphviz_diagram(arch_plan)
+
+    response_payload = {
+        "summary": arch_plan.get("summary", ""),
+        "pattern_id": arch_plan.get("pattern_id", ""),
+        "components": arch_plan.get("components", []),
+        "connections": arch_plan.get("connections", []),
+        "image_url": image_url,
+        "dot": dot_source,
+    }
+
+    # Never pin the fallback plan (same rule as the caches in
+    # architecture_agent): a resend after a degraded response should be
+    # a fresh LLM attempt, not a replay of the error result.
+    if response_payload["pattern_id"] != "fallback_three_tier":
+        with _last_responses_lock:
+            _last_responses[conversation_id] = (text_hash, response_payload)
+            _last_responses.move_to_end(conversation_id)
+            while len(_last_responses) > _LAST_RESPONSES_MAX_ENTRIES:
+                _last_responses.popitem(last=False)
+
+    return jsonify(response_payload)
+
+
+if __name__ == "__main__":
+    # Run development server
+    # Access it in your browser at: http://127.0.0.1:5000
+    app.run(debug=True)
@@ -1,367 +1,613 @@
-"""
-architecture_agent.py
-
-Core logic for the Architecture Design Assistant.
-
-- Uses Azure OpenAI (via LangChain's ChatOpenAI).
-- Wrapped in a LangGraph workflow with an in-memory checkpointer
-  (MemorySaver) so the backend keeps per-conversation state.
-- Now explicitly REFINES the previous architecture plan (if any)
-  instead of redesigning from scratch on follow-up prompts.
-"""
-
-import json
-from typing import Dict, Any, List, TypedDict, Annotated
-import httpx
-from langchain_openai import ChatOpenAI
-import config
-import logging
-import traceback
-from openai import InternalServerError
-
-import operator
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-
-logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)  # later you can change to DEBUG
-
-# ===========================
-# AZURE OPENAI CLIENT
-# ===========================
-
-# Local-only POC workaround to avoid corporate SSL cert issues
-http_client = httpx.Client(verify=False)
-
-client = ChatOpenAI(
-    api_key=config.AZURE_OPENAI_API_KEY,
-    base_url=config.AZURE_OPENAI_ENDPOINT,
-    model=config.OPENAI_MODEL,
-    http_client=http_client,
-    # Lower temperature to improve determinism / consistency
-    temperature=0.1,
-)
-
-# ===========================
-# Load templates
-# ===========================
-
-with open(config.TEMPLATES_PATH, "r", encoding="utf-8") as f:
-    TEMPLATE_DATA = json.load(f)
-
-
-def build_prompt_messages(
-    user_message: str,
-    previous_arch_plan: Dict[str, Any] | None,
-) -> List[Dict[str, Any]]:
-    """
-    Build the message list for the LLM.
-
-    user_message:
-        The full accumulated requirements text
-        (first prompt + any refinements appended by the backend).
-
-    previous_arch_plan:
-        The last architecture plan produced for this conversation
-        (if any). When present, the model is told to REFINE it,
-        not redesign from scratch.
-    """
-    template_summaries = [
-        {
-            "id": p["id"],
-            "name": p["name"],
-            "description": p["description"],
-        }
-        for p in TEMPLATE_DATA.get("patterns", [])
-    ]
-
-    templates_str = json.dumps(template_summaries, indent=2)
-
-    # ---- SYSTEM PROMPT ----
-    system_content = (
-        "You are an Architecture Design Assistant for IT systems. "
-        "Your job is to take high-level requirements and propose a system architecture.\n\n"
-        "You have access to a small library of architecture patterns. "
-        "Each pattern has an id, name, and description. Use them as reusable reference designs.\n\n"
-        "Return ONLY JSON (no markdown outside the JSON block, no extra text). "
-        "The JSON MUST have this structure:\n"
-        "{\n"
-        "  \"summary\": \"An HTML-formatted architecture summary.\",\n"
-        "  \"pattern_id\": \"id of the pattern you are closest to (or 'custom' if none fits)\",\n"
-        "  \"components\": [\n"
-        "    {\"id\": \"short_id\", \"label\": \"Readable name\", \"type\": \"e.g. web, app, db, cache, queue, mobile_client\"}\n"
-        "  ],\n"
-        "  \"connections\": [\n"
-        "    {\"from\": \"component_id\", \"to\": \"component_id\", \"label\": \"protocol or purpose\"}\n"
-        "  ]\n"
-        "}\n"
-        "IDs must be valid Graphviz node identifiers (letters, digits, underscores only). "
-        "Use about 4–12 components to keep the diagram readable.\n\n"
-        "IMPORTANT: The `summary` field MUST be valid HTML, not markdown. Use tags like:\n"
-        "- <h3>Overview</h3>\n"
-        "- <h3>Key Components</h3>\n"
-        "- <h3>Data Flow</h3>\n"
-        "- <h3>Scalability & Reliability</h3>\n"
-        "Within each section, use <ul><li>...</li></ul> bullet lists.\n\n"
-        "SUMMARY LENGTH RULES:\n"
-        "- Keep the HTML formatting EXACTLY the same (h3 headings + bullet lists).\n"
-        "- Keep all <ul><li>...</li></ul> bullet lists.\n"
-        "- Make the summary concise: shorten each bullet point using brief, telegraphic text.\n"
-        "- Keep the meaning but remove verbosity.\n"
-        "- Target 40–60% of the usual summary length.\n\n"
-        "REFINEMENT RULES:\n"
-        "- If a previous architecture plan is provided, treat it as the BASELINE.\n"
-        "- You MUST keep existing component IDs and labels as stable as possible.\n"
-        "- Prefer to ADD components or connections rather than renaming or deleting.\n"
-        "- Only change or remove existing components if the new requirements clearly conflict.\n"
-        "- If a previous pattern_id is provided, keep the same pattern_id unless the user explicitly asks to change the pattern.\n"
-    )
-
-    # ---- USER PROMPT ----
-    user_content_parts: List[str] = []
-
-    user_content_parts.append("Here are the available architecture patterns:\n")
-    user_content_parts.append(templates_str)
-
-    if previous_arch_plan:
-        # We are in a follow-up turn; show the previous plan to the model
-        user_content_parts.append(
-            "\n\nHere is the PREVIOUS architecture plan JSON. "
-            "This is your baseline. REFINE this plan instead of redesigning from scratch:\n"
-        )
-        user_content_parts.append(json.dumps(previous_arch_plan, indent=2))
-
-        user_content_parts.append(
-            "\n\nThe user has provided NEW requirements / refinements. "
-            "Update the existing architecture minimally to satisfy them:\n"
-        )
-        user_content_parts.append(user_message)
-    else:
-        # First turn: design from scratch based on full requirements text
-        user_content_parts.append(
-            "\n\nThe FULL set of user requirements (including any refinements) is:\n"
-        )
-        user_content_parts.append(user_message)
-
-    user_content = "".join(user_content_parts)
-
-    messages = [
-        {"role": "system", "content": system_content},
-        {"role": "user", "content": user_content},
-    ]
-    return messages
-
-
-def _call_model(
-    user_message: str,
-    previous_arch_plan: Dict[str, Any] | None,
-) -> Dict[str, Any]:
-    """
-    Internal helper that calls the LLM and parses the JSON architecture plan.
-
-    user_message:
-        The full accumulated requirements text built by the backend.
-
-    previous_arch_plan:
-        The last architecture plan for this conversation (if any).
-        When present, the model is instructed to REFINE it.
-    """
-    if not config.AZURE_OPENAI_API_KEY:
-        raise RuntimeError("Missing Azure OpenAI API key in config.py")
-
-    messages = build_prompt_messages(user_message, previous_arch_plan)
-
-    print("=== FULL REQUIREMENTS SENT TO MODEL ===")
-    print(user_message)
-    print("=== PREVIOUS ARCH PLAN (if any) ===")
-    print(json.dumps(previous_arch_plan, indent=2) if previous_arch_plan else "None")
-    print("=======================================")
-
-    # Build a single prompt string for ChatOpenAI (as in your original version)
-    system_content = messages[0]["content"]
-    user_content = messages[1]["content"]
-    full_prompt = system_content + "\n\n" + user_content
-
-    try:
-        # ChatOpenAI interface: use invoke()
-        llm_result = client.invoke(full_prompt)
-
-        # llm_result is a ChatMessage-like object; get the text content
-        raw_text = getattr(llm_result, "content", str(llm_result))
-
-        print("=== RAW MODEL OUTPUT ===")
-        print(raw_text)
-        print("========================")
-
-        # ---- CLEANUP LOGIC ----
-        import re
-
-        clean_text = raw_text.strip()
-
-        # If the model wrapped JSON in ```json ... ```
-        if clean_text.startswith("```"):
-            # Extract the first {...} block from inside
-            match = re.search(r"\{[\s\S]*\}", clean_text)
-            if match:
-                clean_text = match.group(0)
-
-        print("=== CLEAN JSON CANDIDATE ===")
-        print(clean_text)
-        print("============================")
-
-        try:
-            arch_plan = json.loads(clean_text)  # ✅ use cleaned text
-        except Exception as e:
-            print("JSON parse failed, using fallback architecture.")
-            print("JSON error:", e)
-            arch_plan = _fallback_architecture("Could not parse JSON from model output.")
-
-    except InternalServerError as e:
-        # This is a 5xx from your gateway (genailab.tcs.in)
-        logger.error("Azure gateway returned 500. Status: %s", e.status_code)
-        try:
-            logger.error("Response body: %s", e.response.text)
-        except Exception:
-            pass
-        raise RuntimeError(
-            "Server error from genailab.tcs.in (500). Check gateway logs / configuration."
-        ) from e
-
-    except Exception as ex:
-        # 🔍 Detailed logging
-        logger.error("Azure OpenAI call failed: %s", ex)
-        logger.error("Exception type: %s", type(ex).__name__)
-        logger.error("Full traceback:\n%s", traceback.format_exc())
-        raise RuntimeError(
-            "Connection error: unable to reach Azure OpenAI. Please check network / VPN."
-        ) from ex
-
-    # Ensure keys exist
-    arch_plan.setdefault("summary", "No summary provided.")
-    arch_plan.setdefault("pattern_id", "unknown")
-    arch_plan.setdefault("components", [])
-    arch_plan.setdefault("connections", [])
-
-    print("=== PARSED ARCH PLAN ===")
-    print(json.dumps(arch_plan, indent=2))
-    print("========================")
-
-    return arch_plan
-
-
-def _fallback_architecture(reason: str) -> Dict[str, Any]:
-    """
-    Fallback architecture plan when something goes wrong.
-    """
-    return {
-        "summary": (
-            f"Fallback architecture used because: {reason}\n\n"
-            "This is a simple three-tier web application."
-        ),
-        "pattern_id": "fallback_three_tier",
-        "components": [
-            {"id": "client", "label": "Client", "type": "client"},
-            {"id": "web", "label": "Web Server", "type": "web"},
-            {"id": "app", "label": "Application Server", "type": "app"},
-            {"id": "db", "label": "Database", "type": "database"},
-        ],
-        "connections": [
-            {"from": "client", "to": "web", "label": "HTTP/HTTPS"},
-            {"from": "web", "to": "app", "label": "Internal HTTP"},
-            {"from": "app", "to": "db", "label": "SQL"},
-        ],
-    }
-
-
-# ===========================
-# LangGraph: state + memory
-# ===========================
-
-class ArchState(TypedDict):
-    """
-    State for the LangGraph workflow.
-
-    - messages: list of requirement text snapshots
-      (we append each call's full requirements string here so we
-       always know the latest).
-    - arch_plan: the latest parsed architecture JSON from the model.
-    - arch_history: list of ALL architecture plans produced so far
-      for this conversation (used to get the previous plan on follow-ups).
-    """
-    messages: Annotated[List[str], operator.add]
-    arch_plan: Dict[str, Any]
-    arch_history: Annotated[List[Dict[str, Any]], operator.add]
-
-
-def _llm_node(state: ArchState) -> ArchState:
-    """
-    LangGraph node that calls the model using the latest requirements text.
-
-    The MemorySaver checkpointer keeps the 'messages' and 'arch_history'
-    per thread_id, so follow-up turns can refine the previous architecture.
-    """
-    messages = state.get("messages") or []
-    if not messages:
-        raise RuntimeError("No requirements text provided to LLM node.")
-
-    # Latest full requirements text (first prompt + refinements)
-    latest_requirements = messages[-1]
-
-    arch_history = state.get("arch_history") or []
-    previous_arch_plan = arch_history[-1] if arch_history else None
-
-    arch_plan = _call_model(latest_requirements, previous_arch_plan)
-
-    # Return only the NEW plan as a delta for arch_history.
-    # MemorySaver + operator.add will append it to the stored list.
-    return {
-        "messages": [],             # we've consumed messages for this step
-        "arch_plan": arch_plan,     # latest plan
-        "arch_history": [arch_plan] # append-only history
-    }
-
-
-# Build the LangGraph workflow with in-memory checkpointing
-_graph_builder = StateGraph(ArchState)
-_graph_builder.add_node("llm", _llm_node)
-_graph_builder.set_entry_point("llm")
-_graph_builder.add_edge("llm", END)
-
-_checkpointer = MemorySaver()
-_arch_graph = _graph_builder.compile(checkpointer=_checkpointer)
-
-
-def call_llm_for_architecture(
-    user_message: str,
-    thread_id: str = "default",
-) -> Dict[str, Any]:
-    """
-    Public entry point used by the Flask app.
-
-    user_message:
-        The full requirements text (first prompt + refinements), as built
-        by app.py for backward-compatible behavior.
-
-    thread_id:
-        Per-conversation identifier used by LangGraph's MemorySaver
-        to maintain server-side state across turns. Should come from
-        the frontend's conversation_id.
-    """
-    if not config.AZURE_OPENAI_API_KEY:
-        raise RuntimeError("Missing Azure OpenAI API key in config.py")
-
-    initial_state: ArchState = {
-        "messages": [user_message],
-        "arch_plan": {},
-        "arch_history": [],
-    }
-
-    final_state = _arch_graph.invoke(
-        initial_state,
-        config={"configurable": {"thread_id": thread_id}},
-    )
-
-    arch_plan = final_state.get("arch_plan") or _fallback_architecture(
-        "Missing arch_plan from LangGraph state."
-    )
-    return arch_plan
+"""
+architecture_agent.py
+
+Core logic for the Architecture Design Assistant.
+
+- Uses Azure OpenAI (via LangChain's ChatOpenAI).
+- Wrapped in a LangGraph workflow with a SQLite-backed checkpointer
+  (SqliteSaver) so per-conversation state survives restarts and is
+  shared across workers.
+- Now explicitly REFINES the previous architecture plan (if any)
+  instead of redesigning from scratch on follow-up prompts.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple, TypedDict, Annotated
+import httpx
+import orjson
+from langchain_openai import ChatOpenAI
+import config
+import semantic_cache
+import logging
+import traceback
+from openai import InternalServerError
+
+import operator
+import sqlite3
+from langgraph.graph import StateGraph, END
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+
+def _dumps(obj: Any) -> str:
+    """
+    Pretty JSON via orjson. All serialization in this module goes
+    through orjson — several dumps run on every LLM call (previous
+    plan, cache key) and the C implementation is ~3-10x faster than
+    stdlib json.
+    """
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+
+
+# ===========================
+# Startup validation
+# ===========================
+
+# Fail fast at import time instead of re-checking config on every
+# request: a bad deploy should die loudly on boot, not per-call.
+if not config.AZURE_OPENAI_API_KEY:
+    raise RuntimeError("Missing Azure OpenAI API key in config.py")
+if not config.OPENAI_MODEL:
+    raise RuntimeError("Missing OPENAI_MODEL in config.py")
+if not os.path.exists(config.TEMPLATES_PATH):
+    raise RuntimeError(f"Templates file not found: {config.TEMPLATES_PATH}")
+
+# ===========================
+# AZURE OPENAI CLIENT
+# ===========================
+
+# Local-only POC workaround to avoid corporate SSL cert issues
+# (verify=False). The default pool (10 connections, 5 keepalive) would
+# throttle concurrent LLM calls and pay a TLS handshake per burst, so
+# the pool is widened and HTTP/2 enabled to multiplex requests over one
+# connection.
+http_client = httpx.Client(
+    verify=False,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    http2=True,
+)
+
+client = ChatOpenAI(
+    api_key=config.AZURE_OPENAI_API_KEY,
+    base_url=config.AZURE_OPENAI_ENDPOINT,
+    model=config.OPENAI_MODEL,
+    http_client=http_client,
+    # Lower temperature to improve determinism / consistency
+    temperature=0.1,
+)
+
+# ===========================
+# Load templates
+# ===========================
+
+with open(config.TEMPLATES_PATH, "rb") as f:
+    TEMPLATE_DATA = orjson.loads(f.read())
+
+# Serialized once at import: TEMPLATE_DATA never mutates, so re-dumping
+# it on every call was wasted CPU — and computing it once also keeps the
+# prompt prefix byte-stable, which provider-side caching depends on.
+_TEMPLATE_SUMMARIES_STR = _dumps(
+    [
+        {
+            "id": p["id"],
+            "name": p["name"],
+            "description": p["description"],
+        }
+        for p in TEMPLATE_DATA.get("patterns", [])
+    ]
+)
+
+_TEMPLATES_CONTENT = (
+    "Here are the available architecture patterns:\n" + _TEMPLATE_SUMMARIES_STR
+)
+
+# ---- SYSTEM PROMPT (static, cacheable) ----
+_SYSTEM_CONTENT = (
+    "You are an Architecture Design Assistant for IT systems. "
+    "Your job is to take high-level requirements and propose a system architecture.\n\n"
+    "You have access to a small library of architecture patterns. "
+    "Each pattern has an id, name, and description. Use them as reusable reference designs.\n\n"
+    "Return ONLY JSON (no markdown outside the JSON block, no extra text). "
+    "The JSON MUST have this structure:\n"
+    "{\n"
+    "  \"summary\": \"An HTML-formatted architecture summary.\",\n"
+    "  \"pattern_id\": \"id of the pattern you are closest to (or 'custom' if none fits)\",\n"
+    "  \"components\": [\n"
+    "    {\"id\": \"short_id\", \"label\": \"Readable name\", \"type\": \"e.g. web, app, db, cache, queue, mobile_client\"}\n"
+    "  ],\n"
+    "  \"connections\": [\n"
+    "    {\"from\": \"component_id\", \"to\": \"component_id\", \"label\": \"protocol or purpose\"}\n"
+    "  ]\n"
+    "}\n"
+    "IDs must be valid Graphviz node identifiers (letters, digits, underscores only). "
+    "Use about 4–12 components to keep the diagram readable.\n\n"
+    "IMPORTANT: The `summary` field MUST be valid HTML, not markdown. Use tags like:\n"
+    "- <h3>Overview</h3>\n"
+    "- <h3>Key Components</h3>\n"
+    "- <h3>Data Flow</h3>\n"
+    "- <h3>Scalability & Reliability</h3>\n"
+    "Within each section, use <ul><li>...</li></ul> bullet lists.\n\n"
+    "SUMMARY LENGTH RULES:\n"
+    "- Keep the HTML formatting EXACTLY the same (h3 headings + bullet lists).\n"
+    "- Keep all <ul><li>...</li></ul> bullet lists.\n"
+    "- Make the summary concise: shorten each bullet point using brief, telegraphic text.\n"
+    "- Keep the meaning but remove verbosity.\n"
+    "- Target 40–60% of the usual summary length.\n\n"
+    "REFINEMENT RULES:\n"
+    "- If a previous architecture plan is provided, treat it as the BASELINE.\n"
+    "- You MUST keep existing component IDs and labels as stable as possible.\n"
+    "- Prefer to ADD components or connections rather than renaming or deleting.\n"
+    "- Only change or remove existing components if the new requirements clearly conflict.\n"
+    "- If a previous pattern_id is provided, keep the same pattern_id unless the user explicitly asks to change the pattern.\n"
+)
+
+
+# ===========================
+# Exact-prompt response cache
+# ===========================
+
+# At temperature 0.1 the model is near-deterministic: identical prompts
+# almost always yield identical JSON, so an exact-match cache is safe.
+# Gated on the configured temperature so raising it later automatically
+# disables the cache.
+_EXACT_CACHE_ENABLED = (client.temperature or 0.0) <= 0.2
+_EXACT_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Size-bounded LRU: refinement prompts embed the full previous plan, so
+# keys rarely repeat across conversations and a plain dict would retain
+# every plan ever produced for the life of the worker. OrderedDict with
+# move_to_end gives least-recently-used eviction on insert.
+_EXACT_CACHE_MAX_ENTRIES = 256
+
+_exact_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_exact_cache_lock = threading.Lock()
+
+# Hit/miss counters for observability (exposed for logging/inspection).
+exact_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _exact_cache_key(messages: List[Dict[str, Any]]) -> str:
+    """
+    SHA-256 over model name + the full serialized prompt.
+    """
+    payload = config.OPENAI_MODEL.encode() + b"|" + orjson.dumps(messages)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _exact_cache_get(key: str) -> Dict[str, Any] | None:
+    with _exact_cache_lock:
+        entry = _exact_cache.get(key)
+        if entry is None:
+            exact_cache_stats["misses"] += 1
+            return None
+        expires_at, arch_plan = entry
+        if time.monotonic() >= expires_at:
+            del _exact_cache[key]
+            exact_cache_stats["misses"] += 1
+            return None
+        _exact_cache.move_to_end(key)
+        exact_cache_stats["hits"] += 1
+        return arch_plan
+
+
+def _exact_cache_put(key: str, arch_plan: Dict[str, Any]) -> None:
+    with _exact_cache_lock:
+        _exact_cache[key] = (
+            time.monotonic() + _EXACT_CACHE_TTL_SECONDS,
+            arch_plan,
+        )
+        _exact_cache.move_to_end(key)
+        # Evict least-recently-used entries; expired ones go first since
+        # they sort to the front after not being touched.
+        while len(_exact_cache) > _EXACT_CACHE_MAX_ENTRIES:
+            _exact_cache.popitem(last=False)
+
+
+def build_prompt_messages(
+    user_message: str,
+    previous_arch_plan: Dict[str, Any] | None,
+) -> List[Dict[str, Any]]:
+    """
+    Build the message list for the LLM.
+
+    The list is deliberately structured as a STATIC PREFIX followed by
+    the dynamic per-turn content, so that provider-side prompt caching
+    (Azure/OpenAI cache identical prefixes automatically) can hit on
+    every follow-up turn:
+
+    1. system message  : invariant instructions (never changes)
+    2. user message    : the pattern library JSON (never changes)
+    3. user message    : the dynamic requirements + previous plan
+
+    user_message:
+        The full accumulated requirements text
+        (first prompt + any refinements appended by the backend).
+
+    previous_arch_plan:
+        The last architecture plan produced for this conversation
+        (if any). When present, the model is told to REFINE it,
+        not redesign from scratch.
+    """
+    # ---- USER PROMPT (dynamic, changes every turn) ----
+    user_content_parts: List[str] = []
+
+    if previous_arch_plan:
+        # We are in a follow-up turn; show the previous plan to the model
+        user_content_parts.append(
+            "Here is the PREVIOUS architecture plan JSON. "
+            "This is your baseline. REFINE this plan instead of redesigning from scratch:\n"
+        )
+        user_content_parts.append(_dumps(previous_arch_plan))
+
+        user_content_parts.append(
+            "\n\nThe user has provided NEW requirements / refinements. "
+            "Update the existing architecture minimally to satisfy them:\n"
+        )
+        user_content_parts.append(user_message)
+    else:
+        # First turn: design from scratch based on full requirements text
+        user_content_parts.append(
+            "The FULL set of user requirements (including any refinements) is:\n"
+        )
+        user_content_parts.append(user_message)
+
+    user_content = "".join(user_content_parts)
+
+    messages = [
+        {"role": "system", "content": _SYSTEM_CONTENT},
+        {"role": "user", "content": _TEMPLATES_CONTENT},
+        {"role": "user", "content": user_content},
+    ]
+    return messages
+
+
+def _stream_model_text(messages: List[Dict[str, Any]]) -> str:
+    """
+    Stream the model response and return the accumulated text.
+
+    Tracks JSON brace balance (string-aware, so braces inside the HTML
+    summary don't confuse it) and stops consuming the stream once the
+    top-level object closes. This overlaps network transfer with
+    generation and skips any trailing ``` fence the model appends.
+    """
+    parts: List[str] = []
+    depth = 0
+    seen_brace = False
+    in_string = False
+    escaped = False
+
+    for chunk in client.stream(messages):
+        piece = chunk.content or ""
+        if not piece:
+            continue
+        parts.append(piece)
+
+        for ch in piece:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"' and seen_brace:
+                in_string = True
+            elif ch == "{":
+                depth += 1
+                seen_brace = True
+            elif ch == "}":
+                depth -= 1
+
+        if seen_brace and depth <= 0:
+            # Top-level JSON object is complete; stop reading.
+            break
+
+    return "".join(parts)
+
+
+def _call_model(
+    user_message: str,
+    previous_arch_plan: Dict[str, Any] | None,
+) -> Dict[str, Any]:
+    """
+    Internal helper that calls the LLM and parses the JSON architecture plan.
+
+    user_message:
+        The full accumulated requirements text built by the backend.
+
+    previous_arch_plan:
+        The last architecture plan for this conversation (if any).
+        When present, the model is instructed to REFINE it.
+    """
+    # Semantic cache: first-turn only. Refinement turns depend on this
+    # conversation's arch_history, so serving them from a shared cache
+    # would leak refinements across conversations. The embedding comes
+    # back even on a miss so store() below doesn't re-embed.
+    semantic_emb = None
+    if previous_arch_plan is None:
+        cached_plan, semantic_emb = semantic_cache.lookup(user_message)
+        if cached_plan is not None:
+            return cached_plan
+
+    messages = build_prompt_messages(user_message, previous_arch_plan)
+
+    # Exact cache: identical (model, prompt) pairs at near-zero
+    # temperature skip the API call entirely.
+    cache_key = None
+    if _EXACT_CACHE_ENABLED:
+        cache_key = _exact_cache_key(messages)
+        cached_plan = _exact_cache_get(cache_key)
+        if cached_plan is not None:
+            logger.info(
+                "Exact prompt cache hit (stats=%s)", exact_cache_stats
+            )
+            return cached_plan
+
+    # Debug-only: the isEnabledFor guard keeps the dump of the whole
+    # plan from running at all in production.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Full requirements sent to model:\n%s", user_message)
+        logger.debug(
+            "Previous arch plan:\n%s",
+            _dumps(previous_arch_plan) if previous_arch_plan else "None",
+        )
+
+    try:
+        # Stream the completion instead of blocking on the full round-trip.
+        # Chunks arrive while the model is still generating, so network
+        # transfer overlaps generation, and we can stop reading as soon as
+        # the JSON object is complete (brace balance back to zero) rather
+        # than waiting for trailing fences or commentary.
+        # The message list is passed as-is so the static system+templates
+        # prefix stays byte-identical across turns (prompt caching).
+        raw_text = _stream_model_text(messages)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Raw model output:\n%s", raw_text)
+
+        # ---- CLEANUP LOGIC ----
+        clean_text = raw_text.strip()
+
+        # Strip any ```json ... ``` wrapper by slicing from the first "{"
+        # to the last "}" — a plain index scan, no regex engine needed.
+        i = clean_text.find("{")
+        j = clean_text.rfind("}")
+        if i != -1 and j > i:
+            clean_text = clean_text[i : j + 1]
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Clean JSON candidate:\n%s", clean_text)
+
+        try:
+            arch_plan = orjson.loads(clean_text)  # ✅ use cleaned text
+        except Exception as e:
+            logger.warning(
+                "JSON parse failed, using fallback architecture: %s", e
+            )
+            arch_plan = _fallback_architecture("Could not parse JSON from model output.")
+
+    except InternalServerError as e:
+        # This is a 5xx from your gateway (genailab.tcs.in)
+        logger.error("Azure gateway returned 500. Status: %s", e.status_code)
+        try:
+            logger.error("Response body: %s", e.response.text)
+        except Exception:
+            pass
+        raise RuntimeError(
+            "Server error from genailab.tcs.in (500). Check gateway logs / configuration."
+        ) from e
+
+    except Exception as ex:
+        # 🔍 Detailed logging
+        logger.error("Azure OpenAI call failed: %s", ex)
+        logger.error("Exception type: %s", type(ex).__name__)
+        logger.error("Full traceback:\n%s", traceback.format_exc())
+        raise RuntimeError(
+            "Connection error: unable to reach Azure OpenAI. Please check network / VPN."
+        ) from ex
+
+    # Ensure keys exist
+    arch_plan.setdefault("summary", "No summary provided.")
+    arch_plan.setdefault("pattern_id", "unknown")
+    arch_plan.setdefault("components", [])
+    arch_plan.setdefault("connections", [])
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Parsed arch plan:\n%s", _dumps(arch_plan))
+
+    # Populate the caches — but never with the fallback plan, which
+    # would pin an error result for identical/similar asks.
+    if arch_plan.get("pattern_id") != "fallback_three_tier":
+        if cache_key is not None:
+            _exact_cache_put(cache_key, arch_plan)
+        if previous_arch_plan is None:
+            semantic_cache.store(user_message, arch_plan, emb=semantic_emb)
+
+    return arch_plan
+
+
+def _fallback_architecture(reason: str) -> Dict[str, Any]:
+    """
+    Fallback architecture plan when something goes wrong.
+    """
+    return {
+        "summary": (
+            f"Fallback architecture used because: {reason}\n\n"
+            "This is a simple three-tier web application."
+        ),
+        "pattern_id": "fallback_three_tier",
+        "components": [
+            {"id": "client", "label": "Client", "type": "client"},
+            {"id": "web", "label": "Web Server", "type": "web"},
+            {"id": "app", "label": "Application Server", "type": "app"},
+            {"id": "db", "label": "Database", "type": "database"},
+        ],
+        "connections": [
+            {"from": "client", "to": "web", "label": "HTTP/HTTPS"},
+            {"from": "web", "to": "app", "label": "Internal HTTP"},
+            {"from": "app", "to": "db", "label": "SQL"},
+        ],
+    }
+
+
+# ===========================
+# LangGraph: state + memory
+# ===========================
+
+# How many past plans to keep per conversation. Only arch_history[-1]
+# is ever read on refinement, but a short tail helps when debugging.
+_ARCH_HISTORY_MAX = 3
+
+
+def _keep_last_plans(
+    old: List[Dict[str, Any]], new: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Append reducer for arch_history with a sliding window.
+
+    A plain operator.add list grows unbounded across turns, and the
+    checkpointer serializes the whole list on every save — O(N) per turn
+    on long conversations. Capping at _ARCH_HISTORY_MAX keeps the
+    per-turn checkpoint cost constant.
+    """
+    return (old + new)[-_ARCH_HISTORY_MAX:]
+
+
+class ArchState(TypedDict):
+    """
+    State for the LangGraph workflow.
+
+    - messages: list of requirement text snapshots
+      (we append each call's full requirements string here so we
+       always know the latest).
+    - arch_plan: the latest parsed architecture JSON from the model.
+    - arch_history: sliding window of the most recent architecture plans
+      for this conversation (used to get the previous plan on follow-ups).
+    """
+    messages: Annotated[List[str], operator.add]
+    arch_plan: Dict[str, Any]
+    arch_history: Annotated[List[Dict[str, Any]], _keep_last_plans]
+
+
+def _llm_node(state: ArchState) -> ArchState:
+    """
+    LangGraph node that calls the model using the latest requirements text.
+
+    The SQLite checkpointer keeps the 'messages' and 'arch_history'
+    per thread_id, so follow-up turns can refine the previous architecture.
+    """
+    messages = state.get("messages") or []
+    if not messages:
+        raise RuntimeError("No requirements text provided to LLM node.")
+
+    # Latest full requirements text (first prompt + refinements)
+    latest_requirements = messages[-1]
+
+    arch_history = state.get("arch_history") or []
+    previous_arch_plan = arch_history[-1] if arch_history else None
+
+    arch_plan = _call_model(latest_requirements, previous_arch_plan)
+
+    # Return only the NEW plan as a delta for arch_history.
+    # The checkpointer + operator.add will append it to the stored list.
+    return {
+        "messages": [],             # we've consumed messages for this step
+        "arch_plan": arch_plan,     # latest plan
+        "arch_history": [arch_plan] # append-only history
+    }
+
+
+# Build the LangGraph workflow with in-memory checkpointing
+_graph_builder = StateGraph(ArchState)
+_graph_builder.add_node("llm", _llm_node)
+_graph_builder.set_entry_point("llm")
+_graph_builder.add_edge("llm", END)
+
+# SQLite-backed checkpointer: MemorySaver lost all conversation state on
+# restart and couldn't be shared across gunicorn workers, so a
+# multi-worker deploy silently fell back to "design from scratch" on
+# follow-up turns. check_same_thread=False is required because Flask
+# serves each request on its own thread; SqliteSaver does its own
+# locking around the connection.
+_checkpoint_conn = sqlite3.connect(
+    config.CHECKPOINT_DB_PATH, check_same_thread=False
+)
+_checkpointer = SqliteSaver(_checkpoint_conn)
+_arch_graph = _graph_builder.compile(checkpointer=_checkpointer)
+
+
+def warm_up() -> None:
+    """
+    Trigger the client's lazy one-time initialization (tiktoken BPE
+    tables, model schema) so the first real request doesn't pay for it.
+    Called from app.py at worker startup.
+    """
+    client.get_num_tokens("warm")
+
+
+def has_conversation_state(thread_id: str) -> bool:
+    """
+    True if the checkpointer already holds state for this conversation,
+    i.e. the next message is a refinement rather than a first prompt.
+    Used by app.py now that the client no longer resends its history.
+    """
+    return _checkpointer.get({"configurable": {"thread_id": thread_id}}) is not None
+
+
+def call_llm_for_architecture(
+    user_message: str,
+    thread_id: str = "default",
+) -> Dict[str, Any]:
+    """
+    Public entry point used by the Flask app.
+
+    user_message:
+        The full requirements text (first prompt + refinements), as built
+        by app.py for backward-compatible behavior.
+
+    thread_id:
+        Per-conversation identifier used by LangGraph's checkpointer
+        to maintain server-side state across turns. Should come from
+        the frontend's conversation_id.
+    """
+    run_config = {"configurable": {"thread_id": thread_id}}
+
+    # First-turn fast path: if the checkpointer has no prior state for
+    # this thread there is nothing to read or refine, so skip the graph
+    # invoke (which round-trips the whole state through the checkpointer)
+    # and call the model directly. The result is written back as a
+    # checkpoint via update_state so follow-up turns refine it as usual.
+    if _checkpointer.get(run_config) is None:
+        arch_plan = _call_model(user_message, None)
+        _arch_graph.update_state(
+            run_config,
+            {
+                "messages": [user_message],
+                "arch_plan": arch_plan,
+                "arch_history": [arch_plan],
+            },
+        )
+        return arch_plan
+
+    initial_state: ArchState = {
+        "messages": [user_message],
+        "arch_plan": {},
+        "arch_history": [],
+    }
+
+    final_state = _arch_graph.invoke(
+        initial_state,
+        config=run_config,
+    )
+
+    arch_plan = final_state.get("arch_plan") or _fallback_architecture(
+        "Missing arch_plan from LangGraph state."
+    )
+    return arch_plan
@@ -17,5 +17,16 @@ AZURE_OPENAI_API_KEY = "sk-YIqkij05K0T3OA20M6gtJg"
 #    e.g. "genailab-maas-gpt-4o" if that's your deployment.
 OPENAI_MODEL = "azure/genailab-maas-gpt-4o"
 
+# 🔹 Deployment name for the embedding model (used by the semantic
+#    response cache; same gateway as the chat model).
+EMBEDDING_MODEL = "azure/genailab-maas-text-embedding-3-large"
+
+# Minimum cosine similarity for a semantic-cache hit.
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
 # Path to the templates JSON file
 TEMPLATES_PATH = os.path.join("data", "templates.json")
+
+# SQLite file for LangGraph conversation checkpoints (survives restarts
+# and is shared across gunicorn workers, unlike in-memory state).
+CHECKPOINT_DB_PATH = "arch_state.db"
@@ -1,126 +1,272 @@
-"""
-diagram_generator.py
-
-Takes a structured architecture plan (components + connections)
-and renders a Graphviz diagram to a PNG image.
-
-Also returns the Graphviz DOT source so the user can edit it
-or load it into other tools.
-"""
-
-import os
-from typing import Dict, Any, Tuple
-from uuid import uuid4
-from graphviz import Digraph
-
-# Manually add Graphviz bin folder (no need to add to system PATH)
-os.environ["PATH"] += os.pathsep + r"C:\graphviz-14.0.4\bin"
-
-def ensure_output_dir() -> str:
-    """
-    Ensure the 'static/diagrams' directory exists.
-    Flask will serve files from the 'static' folder by default.
-    """
-    output_dir = os.path.join("static", "diagrams")
-    os.makedirs(output_dir, exist_ok=True)
-    return output_dir
-
-
-def generate_graphviz_diagram(arch_plan):
-    components = arch_plan.get("components", [])
-    connections = arch_plan.get("connections", [])
-
-    # Create the graph
-    dot = Digraph(comment="Architecture Diagram")
-
-    # Layout tuning for cleaner look
-    dot.attr(
-        "graph",
-        rankdir="LR",      # left → right
-        splines="ortho",   # orthogonal, right-angle edges
-        concentrate="true",# merge parallel edges where possible
-        nodesep="0.6",
-        ranksep="0.9",
-    )
-
-    dot.attr(
-        "node",
-        shape="box",
-        style="rounded,filled",
-        fontsize="12",
-    )
-    dot.attr("edge", fontsize="9")
-
-    # --- Group components by type ---
-    layers = {
-        "frontend": [],
-        "gateway": [],
-        "services": [],
-        "databases": [],
-        "pipeline": [],
-        "other": [],
-    }
-
-    for c in components:
-        ctype = (c.get("type") or "").lower()
-        if ctype in ("client", "web"):
-            layers["frontend"].append(c)
-        elif ctype in ("gateway",):
-            layers["gateway"].append(c)
-        elif ctype in ("app", "service", "microservice"):
-            layers["services"].append(c)
-        elif ctype in ("database", "db"):
-            layers["databases"].append(c)
-        elif ctype in ("data_pipeline", "pipeline", "etl"):
-            layers["pipeline"].append(c)
-        else:
-            layers["other"].append(c)
-
-    # Helper to add a cluster if it has nodes
-    def add_cluster(name, label, comps):
-        if not comps:
-            return
-        with dot.subgraph(name=name) as sg:
-            sg.attr(label=label, style="rounded,dashed", color="#cccccc")
-            for c in comps:
-                sg.node(c["id"], c["label"])
-
-    # --- Create visual clusters ---
-    add_cluster("cluster_frontend", "Frontend", layers["frontend"])
-    add_cluster("cluster_gateway", "API Gateway", layers["gateway"])
-    add_cluster("cluster_services", "Services", layers["services"])
-    add_cluster("cluster_databases", "Databases", layers["databases"])
-    add_cluster("cluster_pipeline", "Reporting / Data Pipeline", layers["pipeline"])
-    add_cluster("cluster_other", "Other", layers["other"])
-
-    # --- Draw edges ---
-    for conn in connections:
-        src = conn.get("from")
-        dst = conn.get("to")
-        if not src or not dst:
-            continue
-
-        label = conn.get("label") or ""
-
-        # Option A: keep labels (a bit busier but informative)
-        dot.edge(src, dst, label=label)
-
-        # Option B (cleaner): hide labels
-        # dot.edge(src, dst)
-
-    # --- Output SVG ---
-    output_dir = os.path.join("static", "diagrams")
-    os.makedirs(output_dir, exist_ok=True)
-
-    file_id = uuid4().hex
-    filename = f"arch_{file_id}"
-    filepath = os.path.join(output_dir, filename)
-
-    dot.format = "svg"
-    rendered_path = dot.render(filename=filepath, cleanup=True)
-
-    # Convert filesystem path to Flask static URL
-    relative_path = rendered_path.replace("\\", "/")
-    dot_source = dot.source
-
-    return "/" + relative_path, dot_source
+"""
+diagram_generator.py
+
+Takes a structured architecture plan (components + connections)
+and renders a Graphviz diagram to an inline SVG data URL.
+
+Also returns the Graphviz DOT source so the user can edit it
+or load it into other tools.
+"""
+
+import base64
+import hashlib
+import os
+import queue
+from collections import OrderedDict, defaultdict
+import subprocess
+import threading
+from typing import Dict, Any, Tuple
+from graphviz import Digraph
+
+# Manually add Graphviz bin folder (no need to add to system PATH)
+os.environ["PATH"] += os.pathsep + r"C:\graphviz-14.0.4\bin"
+
+
+# ===========================
+# Persistent dot process
+# ===========================
+#
+# dot.render() forks a fresh `dot` binary for every request; process
+# creation (especially on Windows) costs ~50-200ms, which dominates
+# rendering time for small diagrams. `dot -Tsvg` happily processes a
+# stream of graphs from stdin, emitting one SVG per graph, so we keep a
+# single long-lived process and pipe each graph through it. Every SVG
+# ends with "</svg>\n", which serves as the output boundary. A dedicated
+# reader thread pumps stdout into a queue because Windows cannot
+# select() on anonymous pipes — blocking reads are the only portable
+# way to wait on the pipe with a timeout.
+
+_SVG_END = b"</svg>"
+_DOT_READ_TIMEOUT = 15.0  # seconds before giving up on the pipe
+
+
+class _DotWorker:
+    """
+    A long-lived `dot -Tsvg` subprocess guarded by a lock.
+
+    If the process dies, misbehaves, or stops producing output within
+    the timeout, it is killed and rendering falls back to a one-shot
+    subprocess for that request; the next request respawns the worker.
+    """
+
+    def __init__(self):
+        self._proc = None
+        self._chunks = None
+        self._leftover = b""
+        self._lock = threading.Lock()
+
+    def _spawn(self):
+        self._proc = subprocess.Popen(
+            ["dot", "-Tsvg"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._leftover = b""
+        self._chunks = queue.Queue()
+        threading.Thread(
+            target=self._pump_stdout,
+            args=(self._proc, self._chunks),
+            daemon=True,
+        ).start()
+
+    @staticmethod
+    def _pump_stdout(proc, chunks):
+        """
+        Blocking reader loop for the worker's stdout. Runs on its own
+        daemon thread and exits when the pipe closes; an empty chunk is
+        queued as the end-of-stream marker.
+        """
+        fd = proc.stdout.fileno()
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except OSError:
+                chunk = b""
+            chunks.put(chunk)
+            if not chunk:
+                break
+
+    def _kill(self):
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+            self._proc = None
+        self._chunks = None
+        self._leftover = b""
+
+    def _read_one_svg(self) -> bytes:
+        """
+        Consume queued stdout chunks until the closing </svg> tag.
+        Bytes after the tag (the trailing newline) are kept for the
+        next render.
+        """
+        buf = self._leftover
+        while _SVG_END not in buf:
+            try:
+                chunk = self._chunks.get(timeout=_DOT_READ_TIMEOUT)
+            except queue.Empty:
+                raise TimeoutError("dot produced no output in time")
+            if not chunk:
+                raise RuntimeError("dot closed its output pipe")
+            buf += chunk
+
+        end = buf.index(_SVG_END) + len(_SVG_END)
+        self._leftover = buf[end:].lstrip(b"\n")
+        return buf[:end] + b"\n"
+
+    def render(self, dot_source: str) -> bytes:
+        with self._lock:
+            try:
+                if self._proc is None or self._proc.poll() is not None:
+                    self._spawn()
+                self._proc.stdin.write(dot_source.encode("utf-8"))
+                # dot starts a new graph at the next "digraph"/"graph"
+                # token; a newline cleanly terminates the previous one.
+                self._proc.stdin.write(b"\n")
+                self._proc.stdin.flush()
+                return self._read_one_svg()
+            except Exception:
+                # Worker is in an unknown state; drop it and fall back
+                # to a one-shot render for this request.
+                self._kill()
+
+        result = subprocess.run(
+            ["dot", "-Tsvg"],
+            input=dot_source.encode("utf-8"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        return result.stdout
+
+
+_dot_worker = _DotWorker()
+
+# Content-addressed cache of rendered diagrams: blake2b(dot source) ->
+# data URL. Identical DOT source always renders identically, so repeat
+# renders (text-only refinements) are served straight from memory.
+# Bounded LRU: each entry is a full base64 SVG (tens of KB), so an
+# uncapped dict would pin every diagram ever rendered for the life of
+# the worker.
+_SVG_CACHE_MAX_ENTRIES = 64
+_svg_cache: "OrderedDict[str, str]" = OrderedDict()
+_svg_cache_lock = threading.Lock()
+
+# Component type -> visual layer. One dict lookup per component instead
+# of walking an if/elif ladder of tuple membership checks.
+_TYPE_TO_LAYER = {
+    "client": "frontend",
+    "web": "frontend",
+    "gateway": "gateway",
+    "app": "services",
+    "service": "services",
+    "microservice": "services",
+    "database": "databases",
+    "db": "databases",
+    "data_pipeline": "pipeline",
+    "pipeline": "pipeline",
+    "etl": "pipeline",
+}
+
+
+def warm_up() -> None:
+    """
+    Spawn the persistent dot process and run one trivial render so the
+    first real request doesn't pay the process-launch cost. Called from
+    app.py at worker startup.
+    """
+    _dot_worker.render("digraph { warmup }")
+
+
+def generate_graphviz_diagram(arch_plan):
+    components = arch_plan.get("components", [])
+    connections = arch_plan.get("connections", [])
+
+    # Create the graph
+    dot = Digraph(comment="Architecture Diagram")
+
+    # Layout tuning for cleaner look
+    dot.attr(
+        "graph",
+        rankdir="LR",      # left → right
+        splines="ortho",   # orthogonal, right-angle edges
+        concentrate="true",# merge parallel edges where possible
+        nodesep="0.6",
+        ranksep="0.9",
+    )
+
+    dot.attr(
+        "node",
+        shape="box",
+        style="rounded,filled",
+        fontsize="12",
+    )
+    dot.attr("edge", fontsize="9")
+
+    # --- Group components by type (single dict lookup per component) ---
+    layers = defaultdict(list)
+
+    for c in components:
+        ctype = (c.get("type") or "").lower()
+        layers[_TYPE_TO_LAYER.get(ctype, "other")].append(c)
+
+    # Helper to add a cluster if it has nodes
+    def add_cluster(name, label, comps):
+        if not comps:
+            return
+        with dot.subgraph(name=name) as sg:
+            sg.attr(label=label, style="rounded,dashed", color="#cccccc")
+            for c in comps:
+                sg.node(c["id"], c["label"])
+
+    # --- Create visual clusters ---
+    add_cluster("cluster_frontend", "Frontend", layers["frontend"])
+    add_cluster("cluster_gateway", "API Gateway", layers["gateway"])
+    add_cluster("cluster_services", "Services", layers["services"])
+    add_cluster("cluster_databases", "Databases", layers["databases"])
+    add_cluster("cluster_pipeline", "Reporting / Data Pipeline", layers["pipeline"])
+    add_cluster("cluster_other", "Other", layers["other"])
+
+    # --- Draw edges ---
+    for conn in connections:
+        src = conn.get("from")
+        dst = conn.get("to")
+        if not src or not dst:
+            continue
+
+        label = conn.get("label") or ""
+
+        # Option A: keep labels (a bit busier but informative)
+        dot.edge(src, dst, label=label)
+
+        # Option B (cleaner): hide labels
+        # dot.edge(src, dst)
+
+    # --- Output SVG (in-memory) ---
+    # Pipe the graph through dot and inline the SVG as a base64 data
+    # URL: no disk write, and the browser shows the diagram without a
+    # second HTTP round-trip to /static.
+    key = hashlib.blake2b(
+        dot.source.encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+    with _svg_cache_lock:
+        image_url = _svg_cache.get(key)
+        if image_url is not None:
+            _svg_cache.move_to_end(key)
+
+    if image_url is None:
+        svg_bytes = _dot_worker.render(dot.source)
+        image_url = (
+            "data:image/svg+xml;base64," + base64.b64encode(svg_bytes).decode()
+        )
+        with _svg_cache_lock:
+            _svg_cache[key] = image_url
+            _svg_cache.move_to_end(key)
+            while len(_svg_cache) > _SVG_CACHE_MAX_ENTRIES:
+                _svg_cache.popitem(last=False)
+
+    return image_url, dot.source
@@ -0,0 +1,139 @@
+"""
+semantic_cache.py
+
+In-process semantic response cache for the Architecture Design Assistant.
+
+Embeds the requirements text and looks up previously produced plans by
+cosine similarity, so a near-identical re-ask (common while the user is
+tweaking wording) skips the full LLM round-trip.
+
+- Vectors are L2-normalized float32 rows in a single preallocated
+  numpy matrix used as a ring buffer, so a top-1 lookup is one
+  matrix-vector product and inserts are O(1) slot writes; once the
+  buffer is full the oldest entries are overwritten (no Redis/FAISS
+  dependency needed at this scale).
+- Only FIRST-TURN requests should be cached: refinement turns depend on
+  per-conversation arch_history, and serving them from a shared cache
+  would leak one conversation's refinements into another.
+- Embedding failures degrade to a cache miss; the cache must never take
+  down the main request path.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from langchain_openai import OpenAIEmbeddings
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Local-only POC workaround to avoid corporate SSL cert issues
+# (same client settings as architecture_agent.py)
+_http_client = httpx.Client(
+    verify=False,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    http2=True,
+)
+
+_embeddings = OpenAIEmbeddings(
+    api_key=config.AZURE_OPENAI_API_KEY,
+    base_url=config.AZURE_OPENAI_ENDPOINT,
+    model=config.EMBEDDING_MODEL,
+    http_client=_http_client,
+    # The gateway is not a real OpenAI endpoint; skip local tokenization
+    check_embedding_ctx_length=False,
+)
+
+# Normalized embedding rows + parallel list of cached plans, used as a
+# fixed-size ring buffer: each entry pins a plan plus a ~12KB float32
+# vector, so an unbounded store would grow for the life of the worker.
+_MAX_ENTRIES = 256
+
+_lock = threading.Lock()
+_matrix: Optional[np.ndarray] = None  # (_MAX_ENTRIES, dim), lazy-allocated
+_plans: List[Optional[Dict[str, Any]]] = [None] * _MAX_ENTRIES
+_size = 0
+_next_slot = 0
+
+
+def _embed(text: str) -> Optional[np.ndarray]:
+    """
+    Embed and L2-normalize `text`; return None if the embedding
+    call fails (treated as a cache miss by callers).
+    """
+    try:
+        vec = np.asarray(_embeddings.embed_query(text), dtype=np.float32)
+    except Exception as ex:
+        logger.warning("Semantic cache embedding failed: %s", ex)
+        return None
+
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        return None
+    return vec / norm
+
+
+def lookup(
+    text: str,
+) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+    """
+    Return (arch_plan, embedding) for the cached plan whose requirements
+    text is most similar to `text`, if the cosine similarity clears the
+    configured threshold; (None, embedding) on a miss.
+
+    The embedding is returned even on a miss so the caller can hand it
+    back to store() and avoid paying a second embedding round-trip for
+    the same text.
+    """
+    emb = _embed(text)
+    if emb is None:
+        return None, None
+
+    with _lock:
+        if _size == 0:
+            return None, emb
+        # Rows are normalized, so the dot product IS cosine similarity.
+        sims = _matrix[:_size] @ emb
+        best = int(np.argmax(sims))
+        best_sim = float(sims[best])
+        plan = _plans[best]
+
+    if best_sim >= config.SEMANTIC_CACHE_THRESHOLD:
+        logger.info("Semantic cache hit (similarity=%.3f)", best_sim)
+        return plan, emb
+    return None, emb
+
+
+def store(
+    text: str,
+    arch_plan: Dict[str, Any],
+    emb: Optional[np.ndarray] = None,
+) -> None:
+    """
+    Add a (requirements text, arch_plan) pair to the cache.
+
+    Pass the embedding returned by lookup() when available; the text is
+    only re-embedded if none is given. Once the ring is full the oldest
+    entry is overwritten.
+    """
+    global _matrix, _size, _next_slot
+
+    if emb is None:
+        emb = _embed(text)
+        if emb is None:
+            return
+
+    with _lock:
+        if _matrix is None:
+            # Preallocate once; the vector dimension is only known when
+            # the first embedding arrives.
+            _matrix = np.zeros((_MAX_ENTRIES, emb.shape[0]), dtype=np.float32)
+        _matrix[_next_slot] = emb
+        _plans[_next_slot] = arch_plan
+        _next_slot = (_next_slot + 1) % _MAX_ENTRIES
+        _size = min(_size + 1, _MAX_ENTRIES)